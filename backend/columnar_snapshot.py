@@ -0,0 +1,309 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from typing import AsyncIterable, Callable, Dict, List, Optional
+
+import numpy as np
+
+class LedgerSnapshot:
+    """Append-only columnar copy of the ledger stored as flat NumPy arrays on local disk.
+
+    One row is written per ledger entry. Suppliers, accounts and currencies are
+    dictionary-encoded, dates are stored as days since 1970-01-01 and impact
+    metrics are carried on the debit row only so that group-by sums never
+    double count an invoice.
+    """
+
+    COLUMNS = {
+        "date": "int32",
+        "supplier_id": "int32",
+        "account_id": "int32",
+        "currency_id": "int32",
+        "entry_type": "int8",  # 0 = debit, 1 = credit
+        "amount": "float64",
+        "base_amount": "float64",  # NaN when no FX rate was available
+        "has_impact": "int8",
+        "water_usage": "float64",
+        "co2_emissions": "float64",
+        "labor_score": "float64",
+        "recycling_rate": "float64",
+    }
+    DIMENSIONS = ("supplier", "account", "currency")
+    IMPACT_METRICS = ("water_usage", "co2_emissions", "labor_score", "recycling_rate")
+    METRICS = ("amount", "base_amount") + IMPACT_METRICS
+    BUCKETS = ("day", "week", "month", "year")
+
+    def __init__(self, directory: str, rescan_seconds: float = 600.0):
+        self.directory = directory
+        self.rescan_seconds = rescan_seconds
+        # Guards appends, rebuilds and in-place patches; never replaced, including by reset()
+        self._lock = asyncio.Lock()
+        self._clear_state()
+        self._load()
+
+    def _clear_state(self):
+        self.rows = 0
+        self.watermark = ""
+        self.refreshed_at: Optional[str] = None
+        self.dictionaries: Dict[str, List[str]] = {name: [] for name in self.DIMENSIONS}
+        self._codes: Dict[str, Dict[str, int]] = {name: {} for name in self.DIMENSIONS}
+        self.invoice_rows: Dict[str, int] = {}
+        self._cache: Optional[Dict[str, np.ndarray]] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = self._path("meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("columns") != list(self.COLUMNS):
+            # Written with a different column layout; start over and let the next refresh rebuild it
+            for name in os.listdir(self.directory):
+                os.remove(self._path(name))
+            return
+        self.rows = meta["rows"]
+        self.watermark = meta["watermark"]
+        self.refreshed_at = meta.get("refreshed_at")
+        self.dictionaries = meta["dictionaries"]
+        self._codes = {name: {value: code for code, value in enumerate(values)} for name, values in self.dictionaries.items()}
+        # Drop anything written after the last committed meta.json (e.g. an interrupted append)
+        for column, dtype in self.COLUMNS.items():
+            path = self._path(f"{column}.bin")
+            size = self.rows * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+        index_path = self._path("invoice_index.txt")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    invoice_id, row = line.split()
+                    if int(row) < self.rows:
+                        self.invoice_rows[invoice_id] = int(row)
+
+    def save(self):
+        meta_path = self._path("meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({
+                "columns": list(self.COLUMNS),
+                "rows": self.rows,
+                "watermark": self.watermark,
+                "refreshed_at": self.refreshed_at,
+                "dictionaries": self.dictionaries,
+            }, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _encode(self, dimension: str, value: str) -> int:
+        codes = self._codes[dimension]
+        if value not in codes:
+            codes[value] = len(self.dictionaries[dimension])
+            self.dictionaries[dimension].append(value)
+        return codes[value]
+
+    @staticmethod
+    def parse_day(value: str) -> Optional[int]:
+        """Days since 1970-01-01 for a YYYY-MM-DD string, or None when it is not a date"""
+
+        try:
+            day = np.datetime64(str(value)[:10], "D")
+        except ValueError:
+            return None
+        return None if np.isnat(day) else int(day.astype("int64"))
+
+    @classmethod
+    def _to_days(cls, date: str, fallback: str) -> int:
+        for value in (date, fallback):
+            day = cls.parse_day(value)
+            if day is not None:
+                return day
+        return 0
+
+    def append(self, invoices: List[dict]):
+        """Append the ledger entries of invoices not yet in the snapshot"""
+
+        columns = {column: [] for column in self.COLUMNS}
+        index_lines = []
+        row = self.rows
+        for invoice in invoices:
+            invoice_id = invoice.get("id")
+            if not invoice_id or invoice_id in self.invoice_rows:
+                continue
+            data = invoice.get("data", {})
+            impact = invoice.get("impact_entry") or {}
+            days = self._to_days(data.get("date", ""), invoice.get("upload_date", ""))
+            supplier_id = self._encode("supplier", data.get("supplier", "Unknown"))
+            currency_id = self._encode("currency", data.get("currency", "USD"))
+            debit_row = None
+            for entry in invoice.get("ledger_entries", []):
+                is_debit = entry.get("type") == "debit"
+                carries_impact = is_debit and debit_row is None and bool(impact)
+                if is_debit and debit_row is None:
+                    debit_row = row
+                columns["date"].append(days)
+                columns["supplier_id"].append(supplier_id)
+                columns["account_id"].append(self._encode("account", entry.get("account", "Unknown")))
+                columns["currency_id"].append(currency_id)
+                columns["entry_type"].append(0 if is_debit else 1)
+                columns["amount"].append(entry.get("amount", 0.0))
+                base_amount = entry.get("base_amount")
+                columns["base_amount"].append(np.nan if base_amount is None else base_amount)
+                columns["has_impact"].append(1 if carries_impact else 0)
+                for metric in self.IMPACT_METRICS:
+                    columns[metric].append(impact.get(metric, 0.0) if carries_impact else 0.0)
+                row += 1
+            if debit_row is not None:
+                self.invoice_rows[invoice_id] = debit_row
+                index_lines.append(f"{invoice_id} {debit_row}\n")
+            self.watermark = max(self.watermark, invoice.get("upload_date", ""))
+
+        if row > self.rows:
+            for column, dtype in self.COLUMNS.items():
+                with open(self._path(f"{column}.bin"), "ab") as f:
+                    np.asarray(columns[column], dtype=dtype).tofile(f)
+            with open(self._path("invoice_index.txt"), "a") as f:
+                f.writelines(index_lines)
+            self.rows = row
+            self._cache = None
+        self.save()
+        return len(index_lines)
+
+    async def update_impact(self, invoice_id: str, impact: dict) -> bool:
+        """Patch impact metrics in place for an invoice already in the snapshot"""
+
+        async with self._lock:
+            row = self.invoice_rows.get(invoice_id)
+            if row is None:
+                return False
+            values = {"has_impact": 1, **{metric: impact.get(metric, 0.0) for metric in self.IMPACT_METRICS}}
+            for column, value in values.items():
+                array = np.memmap(self._path(f"{column}.bin"), dtype=self.COLUMNS[column], mode="r+", shape=(self.rows,))
+                array[row] = value
+                array.flush()
+                del array
+            self._cache = None
+            return True
+
+    def reset(self):
+        """Delete the snapshot files and start empty; callers must hold the lock"""
+
+        for name in os.listdir(self.directory):
+            os.remove(self._path(name))
+        self._clear_state()
+
+    def scan_from(self) -> str:
+        """Lowest upload_date the next refresh must read.
+
+        upload_date is stamped before the insert completes, so an invoice can land
+        after a later one has already advanced the watermark. Re-reading a window
+        behind the watermark picks those up; append() skips ids already present.
+        """
+
+        if not self.watermark:
+            return ""
+        try:
+            return (datetime.fromisoformat(self.watermark) - timedelta(seconds=self.rescan_seconds)).isoformat()
+        except ValueError:
+            return ""
+
+    async def refresh(self, invoices_since: Callable[[str], AsyncIterable[dict]], rebuild: bool = False,
+                      batch_size: int = 10000) -> int:
+        """Append invoices yielded by invoices_since(scan_from()), optionally rebuilding from scratch first"""
+
+        async with self._lock:
+            if rebuild:
+                self.reset()
+            appended = 0
+            batch = []
+            async for invoice in invoices_since(self.scan_from()):
+                batch.append(invoice)
+                if len(batch) >= batch_size:
+                    appended += self.append(batch)
+                    batch = []
+            appended += self.append(batch)
+            self.refreshed_at = datetime.now().isoformat()
+            self.save()
+            return appended
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        if self._cache is None:
+            if self.rows == 0:
+                self._cache = {column: np.empty(0, dtype=dtype) for column, dtype in self.COLUMNS.items()}
+            else:
+                self._cache = {
+                    column: np.memmap(self._path(f"{column}.bin"), dtype=dtype, mode="r", shape=(self.rows,))
+                    for column, dtype in self.COLUMNS.items()
+                }
+        return self._cache
+
+    @staticmethod
+    def _bucket_days(days: np.ndarray, bucket: str) -> np.ndarray:
+        if bucket == "week":
+            # 1970-01-01 was a Thursday; shift so weeks start on Monday
+            return days - (days + 3) % 7
+        if bucket == "month":
+            return days.astype("datetime64[D]").astype("datetime64[M]").astype("int64")
+        if bucket == "year":
+            return days.astype("datetime64[D]").astype("datetime64[Y]").astype("int64")
+        return days
+
+    @staticmethod
+    def _bucket_label(value: int, bucket: str) -> str:
+        if bucket == "month":
+            return str(np.datetime64(int(value), "M"))
+        if bucket == "year":
+            return str(np.datetime64(int(value), "Y"))
+        return str(np.datetime64(int(value), "D"))
+
+    def query(self, group_by: List[str], bucket: Optional[str], metric: str,
+              start: Optional[str], end: Optional[str], entry_type: Optional[str]) -> List[dict]:
+        """Aggregate metric over the snapshot grouped by dimensions and an optional time bucket"""
+
+        cols = self.columns()
+        mask = np.ones(self.rows, dtype=bool)
+        # start/end are validated by the caller; unparseable values are ignored here
+        if start and self.parse_day(start) is not None:
+            mask &= cols["date"] >= self.parse_day(start)
+        if end and self.parse_day(end) is not None:
+            mask &= cols["date"] <= self.parse_day(end)
+        if entry_type in ("debit", "credit"):
+            mask &= cols["entry_type"] == (0 if entry_type == "debit" else 1)
+        if metric in self.IMPACT_METRICS:
+            mask &= cols["has_impact"] == 1
+        if metric == "base_amount":
+            mask &= ~np.isnan(cols["base_amount"])
+
+        values = np.asarray(cols[metric][mask], dtype="float64")
+        keys, sizes, decoders = [], [], []
+        for dimension in group_by:
+            keys.append(np.asarray(cols[f"{dimension}_id"][mask], dtype="int64"))
+            sizes.append(max(len(self.dictionaries[dimension]), 1))
+            decoders.append((dimension, self.dictionaries[dimension].__getitem__))
+        if bucket:
+            bucket_values, bucket_codes = np.unique(
+                self._bucket_days(np.asarray(cols["date"][mask], dtype="int64"), bucket), return_inverse=True
+            )
+            keys.append(bucket_codes.astype("int64"))
+            sizes.append(max(len(bucket_values), 1))
+            decoders.append(("bucket", lambda code: self._bucket_label(bucket_values[code], bucket)))
+
+        if not keys:
+            count = int(values.size)
+            total = float(values.sum())
+            return [{"sum": total, "count": count, "avg": total / count if count else 0.0}]
+
+        composite = np.ravel_multi_index(keys, sizes)
+        groups, inverse = np.unique(composite, return_inverse=True)
+        sums = np.bincount(inverse, weights=values, minlength=len(groups))
+        counts = np.bincount(inverse, minlength=len(groups))
+        group_keys = np.unravel_index(groups, sizes)
+
+        results = []
+        for i in range(len(groups)):
+            result = {name: decode(int(group_keys[k][i])) for k, (name, decode) in enumerate(decoders)}
+            result.update({"sum": float(sums[i]), "count": int(counts[i]), "avg": float(sums[i] / counts[i])})
+            results.append(result)
+        return results
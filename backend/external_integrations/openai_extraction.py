@@ -0,0 +1,157 @@
+import asyncio
+import json
+import random
+import time
+from typing import Optional
+
+EXTRACTION_PROMPT = """Extract invoice data from this image and return ONLY a JSON object with these fields:
+                            {
+                                "date": "YYYY-MM-DD format",
+                                "supplier": "Company name",
+                                "amount": 123.45,
+                                "description": "Brief description of goods/services",
+                                "currency": "USD"
+                            }
+
+                            Be precise with the amount and make sure the date is in YYYY-MM-DD format."""
+
+def retryable_errors() -> tuple:
+    """Errors worth retrying and counting against the circuit breaker: the service is slow, overloaded or down"""
+
+    import openai
+
+    return (
+        asyncio.TimeoutError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+class ExtractionError(Exception):
+    """Extraction did not produce usable invoice data"""
+
+class ExtractionUnavailable(ExtractionError):
+    """The extraction service is degraded, either failing now or short-circuited by the breaker"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial call"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class ExtractionClient:
+    """OpenAI Vision extraction with per-call timeouts, jittered retries and a circuit breaker"""
+
+    def __init__(self, api_key: Optional[str], model: str = "gpt-4o", timeout: float = 30.0,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self._client = None
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+    @property
+    def client(self):
+        # openai is imported and the client built on the first extraction, not at startup
+        if self._client is None:
+            import openai
+
+            # Retries are handled here so they are visible to the breaker
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        return self._client
+
+    async def extract(self, image_base64: str) -> dict:
+        """Return the invoice fields extracted from a base64 JPEG/PNG image"""
+
+        import openai
+
+        retryable = retryable_errors()
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise ExtractionUnavailable("OpenAI extraction circuit is open")
+            try:
+                response = await asyncio.wait_for(self._complete(image_base64), timeout=self.timeout)
+            except retryable as e:
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise ExtractionUnavailable(f"OpenAI extraction failed after {attempt + 1} attempts: {e!r}") from e
+                # Full jitter keeps parked workers from retrying in lockstep
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                continue
+            except openai.OpenAIError as e:
+                # The service answered; the request itself was rejected
+                self.breaker.record_success()
+                raise ExtractionError(f"OpenAI rejected the extraction request: {e!r}") from e
+            except BaseException:
+                # Cancellation or an unexpected error must not leave a half-open trial claimed forever
+                self.breaker.record_failure()
+                raise
+
+            self.breaker.record_success()
+            return self._parse(response.choices[0].message.content or "")
+
+    async def _complete(self, image_base64: str):
+        return await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": EXTRACTION_PROMPT},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+                    ]
+                }
+            ],
+            max_tokens=500
+        )
+
+    @staticmethod
+    def _parse(response_text: str) -> dict:
+        response_text = response_text.strip()
+        # Clean up the response if it contains markdown formatting
+        if response_text.startswith("```"):
+            response_text = response_text.replace("```json", "").replace("```", "").strip()
+        try:
+            data = json.loads(response_text)
+        except json.JSONDecodeError as e:
+            raise ExtractionError(f"OpenAI returned non-JSON content: {response_text[:200]!r}") from e
+        if not isinstance(data, dict):
+            raise ExtractionError(f"OpenAI returned unexpected JSON: {response_text[:200]!r}")
+        return data
@@ -3,23 +3,71 @@ import uuid
 import hashlib
 import base64
 import tempfile
+import asyncio
+import bisect
+import csv
+import re
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from io import BytesIO
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
-import openai
-from pdf2image import convert_from_path
-from PIL import Image
-import json
+
+from external_integrations.openai_extraction import (
+    CircuitBreaker,
+    ExtractionClient,
+    ExtractionError,
+    ExtractionUnavailable,
+)
+
+# openai, pdf2image, PIL and numpy are imported on first use to keep cold starts fast
+if TYPE_CHECKING:
+    from PIL import Image
 
 load_dotenv()
 
-app = FastAPI(title="QuadLedger API")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create clients and background jobs on startup and release them on shutdown"""
+    
+    global client, db, extraction_client
+    from motor.motor_asyncio import AsyncIOMotorClient
+    
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL"))
+    db = client[os.environ.get("DB_NAME", "quadledger_db")]
+    extraction_client = ExtractionClient(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        timeout=float(os.environ.get("OPENAI_TIMEOUT_SECONDS", "30")),
+        max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", "2")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get("OPENAI_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.environ.get("OPENAI_BREAKER_RESET_SECONDS", "60"))
+        )
+    )
+    
+    # Index builds and migrations run in the background so they never delay the first request
+    tasks = [
+        asyncio.create_task(ensure_indexes()),
+        asyncio.create_task(backfill_missing_conversions()),
+        asyncio.create_task(snapshot_refresh_loop()),
+        asyncio.create_task(pending_extraction_loop()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    # Let in-flight snapshot appends and pending batches unwind before the client goes away
+    await asyncio.gather(*tasks, return_exceptions=True)
+    client.close()
+
+app = FastAPI(title="QuadLedger API", lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -30,12 +78,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database setup
-client = AsyncIOMotorClient(os.environ.get("MONGO_URL"))
-db = client[os.environ.get("DB_NAME", "quadledger_db")]
+# Database setup (client is created in lifespan)
+client = None
+db = None
+
+# OpenAI setup (extraction_client is created in lifespan)
+extraction_client = None
+PENDING_RETRY_SECONDS = int(os.environ.get("PENDING_RETRY_SECONDS", "60"))
+PENDING_BATCH_SIZE = int(os.environ.get("PENDING_BATCH_SIZE", "20"))
+PENDING_MAX_ATTEMPTS = int(os.environ.get("PENDING_MAX_ATTEMPTS", "5"))
 
-# OpenAI setup
-openai_client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Columnar snapshot setup
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot"))
+SNAPSHOT_REFRESH_SECONDS = int(os.environ.get("SNAPSHOT_REFRESH_SECONDS", "300"))
+SNAPSHOT_RESCAN_SECONDS = int(os.environ.get("SNAPSHOT_RESCAN_SECONDS", "600"))
+
+# Currency setup
+BASE_CURRENCY = os.environ.get("BASE_CURRENCY", "USD").upper()
+FX_RATES_CSV = os.environ.get("FX_RATES_CSV", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fx_rates.csv"))
 
 # Pydantic models
 class InvoiceData(BaseModel):
@@ -52,6 +112,10 @@ class LedgerEntry(BaseModel):
     amount: float
     invoice_id: str
     date: str
+    currency: str = "USD"
+    base_currency: Optional[str] = None
+    base_amount: Optional[float] = None  # None when no FX rate was available
+    fx_rate: Optional[float] = None
 
 class VerifiedTransaction(BaseModel):
     id: str
@@ -77,79 +141,58 @@ class InvoiceRecord(BaseModel):
     verified_transaction: VerifiedTransaction
     impact_entry: Optional[ImpactEntry] = None
     file_content: str  # base64 encoded
+    content_hash: Optional[str] = None  # sha256 of the uploaded bytes
+    duplicate_key: Optional[str] = None  # normalized supplier|date|amount|currency
+    page_hash: Optional[str] = None  # 256-bit dHash of the first page, hex
+    page_hash_bands: List[str] = []
+    duplicate_of: List[str] = []
+
+class PendingInvoice(BaseModel):
+    """Upload parked until extraction succeeds; kept out of db.invoices so it never reaches the ledger"""
+    id: str
+    filename: str
+    upload_date: str
+    file_content: str  # base64 encoded
+    content_hash: str
+    page_hash: Optional[str] = None
+    on_duplicate: str = "flag"  # duplicate policy of the original upload, applied when it is posted
+    status: str = "pending_extraction"  # or "extraction_failed" after PENDING_MAX_ATTEMPTS, or "duplicate_rejected"
+    duplicate_of: List[str] = []
+    attempts: int = 0
+    last_error: Optional[str] = None
 
 # Helper functions
-async def extract_invoice_data(file_content: bytes, filename: str) -> InvoiceData:
-    """Extract invoice data using OpenAI Vision API"""
+def render_first_page(file_content: bytes, filename: str) -> "Image.Image":
+    """Render the first page of a PDF, or open an image upload"""
+    
+    from PIL import Image
     
-    # Convert PDF to images if necessary
-    images = []
     if filename.lower().endswith('.pdf'):
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
             tmp.write(file_content)
             tmp.flush()
-            pdf_images = convert_from_path(tmp.name, dpi=200)
-            for img in pdf_images:
-                buffered = BytesIO()
-                img.save(buffered, format="JPEG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode()
-                images.append(img_base64)
+            from pdf2image import convert_from_path
+            
+            # Only the first page is sent for extraction and hashed for duplicate detection
+            return convert_from_path(tmp.name, dpi=200, first_page=1, last_page=1)[0]
+    return Image.open(BytesIO(file_content))
+
+async def extract_invoice_data(file_content: bytes, filename: str, first_page: "Image.Image") -> InvoiceData:
+    """Extract invoice data using OpenAI Vision API, raising ExtractionError instead of guessing"""
+    
+    if filename.lower().endswith('.pdf'):
+        buffered = BytesIO()
+        first_page.convert("RGB").save(buffered, format="JPEG")
+        image_base64 = base64.b64encode(buffered.getvalue()).decode()
     else:
         # Handle image files directly
-        img_base64 = base64.b64encode(file_content).decode()
-        images.append(img_base64)
+        image_base64 = base64.b64encode(file_content).decode()
     
-    # Process with OpenAI Vision API
+    invoice_data = await extraction_client.extract(image_base64)
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Extract invoice data from this image and return ONLY a JSON object with these fields:
-                            {
-                                "date": "YYYY-MM-DD format",
-                                "supplier": "Company name",
-                                "amount": 123.45,
-                                "description": "Brief description of goods/services",
-                                "currency": "USD"
-                            }
-                            
-                            Be precise with the amount and make sure the date is in YYYY-MM-DD format."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{images[0]}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=500
-        )
-        
-        # Parse the JSON response
-        response_text = response.choices[0].message.content.strip()
-        # Clean up the response if it contains markdown formatting
-        if response_text.startswith("```json"):
-            response_text = response_text.replace("```json", "").replace("```", "").strip()
-        
-        invoice_data = json.loads(response_text)
         return InvoiceData(**invoice_data)
-        
-    except Exception as e:
-        # Fallback to mock data if OpenAI fails
-        return InvoiceData(
-            date=datetime.now().strftime("%Y-%m-%d"),
-            supplier="Auto-detected Supplier",
-            amount=100.00,
-            description="Invoice processing - OpenAI extraction failed",
-            currency="USD"
-        )
+    except ValidationError as e:
+        raise ExtractionError(f"Extracted invoice data is incomplete: {e}") from e
 
 def generate_ledger_entries(invoice_data: InvoiceData, invoice_id: str) -> List[LedgerEntry]:
     """Generate automatic debit and credit entries based on invoice content"""
@@ -169,14 +212,15 @@ def generate_ledger_entries(invoice_data: InvoiceData, invoice_id: str) -> List[
     # Credit account logic (assuming most invoices create payables)
     credit_account = "Accounts Payable"
     
-    return [
+    entries = [
         LedgerEntry(
             id=str(uuid.uuid4()),
             type="debit",
             account=debit_account,
             amount=invoice_data.amount,
             invoice_id=invoice_id,
-            date=invoice_data.date
+            date=invoice_data.date,
+            currency=invoice_data.currency
         ),
         LedgerEntry(
             id=str(uuid.uuid4()),
@@ -184,9 +228,11 @@ def generate_ledger_entries(invoice_data: InvoiceData, invoice_id: str) -> List[
             account=credit_account,
             amount=invoice_data.amount,
             invoice_id=invoice_id,
-            date=invoice_data.date
+            date=invoice_data.date,
+            currency=invoice_data.currency
         )
     ]
+    return [convert_ledger_entry(entry) for entry in entries]
 
 def create_verified_transaction(invoice_id: str, ledger_entries: List[LedgerEntry]) -> VerifiedTransaction:
     """Create immutable transaction record with hash"""
@@ -207,13 +253,375 @@ def create_verified_transaction(invoice_id: str, ledger_entries: List[LedgerEntr
         invoice_id=invoice_id
     )
 
+async def post_invoice(invoice_id: str, filename: str, file_base64: str, invoice_data: InvoiceData,
+                       content_hash: str, duplicate_key: str, page_hash: Optional[str],
+                       duplicate_of: List[str]) -> InvoiceRecord:
+    """Generate ledger entries and the verified transaction for extracted data and store the invoice"""
+    
+    # Generate automatic ledger entries
+    ledger_entries = generate_ledger_entries(invoice_data, invoice_id)
+    
+    # Create immutable transaction record
+    verified_transaction = create_verified_transaction(invoice_id, ledger_entries)
+    
+    # Create complete invoice record
+    invoice_record = InvoiceRecord(
+        id=invoice_id,
+        filename=filename,
+        upload_date=datetime.now().isoformat(),
+        data=invoice_data,
+        ledger_entries=ledger_entries,
+        verified_transaction=verified_transaction,
+        file_content=file_base64,
+        content_hash=content_hash,
+        duplicate_key=duplicate_key,
+        page_hash=page_hash,
+        page_hash_bands=page_hash_bands(page_hash) if page_hash else [],
+        duplicate_of=duplicate_of
+    )
+    
+    # Store in database
+    await db.invoices.insert_one(invoice_record.model_dump())
+    return invoice_record
+
+# Pending extraction
+pending_lock = asyncio.Lock()
+
+async def record_pending_failure(pending: dict, error: str):
+    """Count a failed attempt, giving up on the upload after PENDING_MAX_ATTEMPTS"""
+    
+    attempts = pending.get("attempts", 0) + 1
+    status = "extraction_failed" if attempts >= PENDING_MAX_ATTEMPTS else "pending_extraction"
+    await db.pending_invoices.update_one(
+        {"id": pending["id"]},
+        {"$set": {"attempts": attempts, "status": status, "last_error": error}}
+    )
+
+async def process_pending_invoice(pending: dict) -> str:
+    """Retry extraction for one parked upload and return "posted", "failed" or "rejected".
+
+    ExtractionUnavailable propagates so the batch can stop.
+    """
+    
+    # A crash between posting and deleting leaves the invoice already in the ledger
+    if await db.invoices.find_one({"id": pending["id"]}, {"_id": 1}):
+        await db.pending_invoices.delete_one({"id": pending["id"]})
+        return "posted"
+    
+    file_content = base64.b64decode(pending["file_content"])
+    first_page = await asyncio.to_thread(render_first_page, file_content, pending["filename"])
+    try:
+        invoice_data = await extract_invoice_data(file_content, pending["filename"], first_page)
+    except ExtractionUnavailable:
+        raise
+    except ExtractionError as e:
+        await record_pending_failure(pending, str(e))
+        return "failed"
+    
+    duplicate_key = compute_duplicate_key(invoice_data.model_dump())
+    duplicate_of = await find_duplicates(pending["content_hash"], invoice_data.model_dump(), pending.get("page_hash"))
+    if duplicate_of and pending.get("on_duplicate", DUPLICATE_POLICY) == "reject":
+        await db.pending_invoices.update_one(
+            {"id": pending["id"]},
+            {"$set": {"status": "duplicate_rejected", "duplicate_of": sorted(duplicate_of)}}
+        )
+        return "rejected"
+    # upload_date is set when the invoice is posted so the snapshot's upload_date watermark picks it up
+    await post_invoice(
+        pending["id"], pending["filename"], pending["file_content"], invoice_data,
+        pending["content_hash"], duplicate_key, pending.get("page_hash"), sorted(duplicate_of)
+    )
+    await db.pending_invoices.delete_one({"id": pending["id"]})
+    return "posted"
+
+async def reprocess_pending_invoices(limit: int = PENDING_BATCH_SIZE) -> dict:
+    """Run one batch of parked uploads through extraction, oldest first"""
+    
+    outcomes = {"posted": 0, "failed": 0, "rejected": 0}
+    async with pending_lock:
+        batch = await db.pending_invoices.find({"status": "pending_extraction"}).sort("upload_date", 1).to_list(limit)
+        for pending in batch:
+            try:
+                outcomes[await process_pending_invoice(pending)] += 1
+            except ExtractionUnavailable as e:
+                # Still degraded; leave the rest of the batch for the next run
+                await db.pending_invoices.update_one({"id": pending["id"]}, {"$set": {"last_error": str(e)}})
+                break
+            except Exception as e:
+                # A corrupt upload must not block the uploads queued behind it
+                logger.exception(f"Reprocessing pending invoice {pending['id']} failed")
+                await record_pending_failure(pending, repr(e))
+                outcomes["failed"] += 1
+    remaining = await db.pending_invoices.count_documents({"status": "pending_extraction"})
+    return {"processed": outcomes["posted"], "failed": outcomes["failed"], "rejected": outcomes["rejected"], "remaining": remaining}
+
+async def pending_extraction_loop():
+    while True:
+        await asyncio.sleep(PENDING_RETRY_SECONDS)
+        if extraction_client.breaker.state == "open":
+            continue
+        try:
+            await reprocess_pending_invoices()
+        except Exception:
+            logger.exception("Pending extraction batch failed")
+
+# Duplicate detection
+async def ensure_indexes():
+    try:
+        await db.invoices.create_index("content_hash")
+        await db.invoices.create_index("duplicate_key")
+        await db.invoices.create_index("page_hash_bands")
+        await db.pending_invoices.create_index("id")
+        await db.pending_invoices.create_index("content_hash")
+    except Exception:
+        logger.exception("Could not create invoice indexes")
+
+LEGAL_SUFFIXES = {"inc", "incorporated", "ltd", "limited", "llc", "corp", "corporation", "co", "company",
+                  "gmbh", "srl", "sa", "plc", "ag", "bv"}
+PAGE_HASH_SIZE = 16  # 16x16 dHash, 256 bits
+PAGE_HASH_BANDS = 8  # 32-bit bands: any two hashes within 7 bits share at least one band
+PAGE_HASH_MAX_DISTANCE = int(os.environ.get("PAGE_HASH_MAX_DISTANCE", "6"))
+PAGE_HASH_BUCKET_CAP = 50  # band members compared per (band, date, amount) bucket when clustering
+DUPLICATE_POLICY = os.environ.get("DUPLICATE_POLICY", "flag")  # "flag" or "reject"
+
+def normalize_supplier(supplier: str) -> str:
+    words = re.sub(r"[^a-z0-9]+", " ", supplier.lower()).split()
+    return " ".join(word for word in words if word not in LEGAL_SUFFIXES)
+
+def compute_duplicate_key(invoice_data: dict) -> str:
+    """Key shared by re-scans and re-exports of the same invoice"""
+    
+    return "|".join([
+        normalize_supplier(invoice_data.get("supplier", "")),
+        str(invoice_data.get("date", ""))[:10],
+        f"{float(invoice_data.get('amount', 0)):.2f}",
+        str(invoice_data.get("currency", "USD")).upper()
+    ])
+
+def compute_page_hash(page: "Image.Image") -> str:
+    """256-bit difference hash (dHash) of a rendered page, as 64 hex digits.
+
+    Pages from one template hash close together even at this size, so a match
+    is only a candidate and must be confirmed with the extracted date and amount.
+    """
+    
+    from PIL import Image
+    
+    size = PAGE_HASH_SIZE
+    pixels = list(page.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            bits = (bits << 1) | (pixels[row * (size + 1) + col] > pixels[row * (size + 1) + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+def page_hash_bands(page_hash: str) -> List[str]:
+    width = len(page_hash) // PAGE_HASH_BANDS
+    return [f"{i}:{page_hash[i * width:(i + 1) * width]}" for i in range(PAGE_HASH_BANDS)]
+
+def page_hash_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def same_date_and_amount(a: Optional[str], b: Optional[str]) -> bool:
+    """Compare the date and amount parts of two duplicate keys"""
+    
+    return bool(a and b) and a.split("|")[1:3] == b.split("|")[1:3]
+
+async def find_duplicates(content_hash: Optional[str] = None, invoice_data: Optional[dict] = None,
+                          page_hash: Optional[str] = None) -> List[str]:
+    """Look up probable duplicates through the indexed hash and key fields.
+
+    Without invoice_data only byte-identical uploads match. With it, invoices
+    with the same duplicate key match, and so do near-identical first pages
+    with the same date and amount.
+    """
+    
+    duplicate_key = compute_duplicate_key(invoice_data) if invoice_data else None
+    clauses = []
+    if content_hash:
+        clauses.append({"content_hash": content_hash})
+    if duplicate_key:
+        clauses.append({"duplicate_key": duplicate_key})
+        if page_hash:
+            clauses.append({
+                "page_hash_bands": {"$in": page_hash_bands(page_hash)},
+                "data.date": invoice_data.get("date"),
+                "data.amount": invoice_data.get("amount")
+            })
+    if not clauses:
+        return []
+    
+    matches = []
+    candidates = db.invoices.find({"$or": clauses}, {"_id": 0, "id": 1, "content_hash": 1, "duplicate_key": 1, "page_hash": 1})
+    async for candidate in candidates:
+        if (content_hash and candidate.get("content_hash") == content_hash) \
+                or (duplicate_key and candidate.get("duplicate_key") == duplicate_key) \
+                or (page_hash and candidate.get("page_hash")
+                    and same_date_and_amount(duplicate_key, candidate.get("duplicate_key"))
+                    and page_hash_distance(page_hash, candidate["page_hash"]) <= PAGE_HASH_MAX_DISTANCE):
+            matches.append(candidate["id"])
+    return matches
+
+class UnionFind:
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+
+    def find(self, item: str) -> str:
+        self.parent.setdefault(item, item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: str, b: str):
+        self.parent[self.find(a)] = self.find(b)
+
+# FX rate table
+class FxRateTable:
+    """Date-effective FX rates loaded from CSV, indexed per currency for binary search.
+
+    The CSV has ``date,currency,rate`` columns where ``rate`` is the number of
+    base-currency units for one unit of ``currency``, effective from ``date``
+    until the next row for the same currency.
+    """
+
+    def __init__(self, path: str, base_currency: str):
+        self.path = path
+        self.base_currency = base_currency
+        self.dates: Dict[str, List[str]] = {}
+        self.rates: Dict[str, List[float]] = {}
+        self.loaded_at: Optional[str] = None
+        self.load()
+
+    def load(self):
+        rows: Dict[str, List[tuple]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, newline="") as f:
+                for line, row in enumerate(csv.DictReader(f), start=2):
+                    try:
+                        currency = (row["currency"] or "").strip().upper()
+                        date = datetime.strptime((row["date"] or "").strip()[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+                        rate = float(row["rate"])
+                        if not currency or rate <= 0:
+                            raise ValueError("missing currency or non-positive rate")
+                    except (KeyError, TypeError, ValueError) as e:
+                        # One bad line must not keep the API from starting or abort a reconvert
+                        logger.warning("Skipping invalid FX rate at %s line %d: %s", self.path, line, e)
+                        continue
+                    rows.setdefault(currency, []).append((date, rate))
+        # Later rows win when a currency has two rates for the same date (corrections appended to the file)
+        self.dates, self.rates = {}, {}
+        for currency, entries in rows.items():
+            by_date = dict(sorted(entries, key=lambda entry: entry[0]))
+            self.dates[currency] = list(by_date)
+            self.rates[currency] = list(by_date.values())
+        self.loaded_at = datetime.now().isoformat()
+
+    def rate(self, currency: str, date: str) -> Optional[float]:
+        """Rate effective on date, or None when no rate is known for that currency and date"""
+
+        currency = (currency or self.base_currency).upper()
+        if currency == self.base_currency:
+            return 1.0
+        dates = self.dates.get(currency)
+        if not dates:
+            return None
+        i = bisect.bisect_right(dates, str(date)[:10])
+        return self.rates[currency][i - 1] if i else None
+
+fx_rates = FxRateTable(FX_RATES_CSV, BASE_CURRENCY)
+
+def convert_ledger_entry(entry: LedgerEntry) -> LedgerEntry:
+    """Fill in the base-currency amount of a ledger entry from the FX table"""
+
+    rate = fx_rates.rate(entry.currency, entry.date)
+    entry.base_currency = fx_rates.base_currency
+    entry.fx_rate = rate
+    entry.base_amount = round(entry.amount * rate, 2) if rate is not None else None
+    return entry
+
+async def convert_stored_ledger_entries(only_missing: bool = False) -> int:
+    """Recompute base-currency fields on stored ledger entries, in bulk"""
+    
+    import pymongo
+    
+    # only_missing limits the pass to entries written before conversions were stored
+    query = {"ledger_entries": {"$elemMatch": {"base_currency": {"$exists": False}}}} if only_missing else {}
+    updates = []
+    updated_invoices = 0
+    cursor = db.invoices.find(query, {"_id": 0, "id": 1, "data.currency": 1, "ledger_entries": 1})
+    async for invoice in cursor:
+        entries = invoice.get("ledger_entries", [])
+        # Entries written before currencies were tracked inherit the invoice currency
+        currency = invoice.get("data", {}).get("currency", "USD")
+        converted = [convert_ledger_entry(LedgerEntry(**{"currency": currency, **entry})).model_dump() for entry in entries]
+        # Only the derived conversion fields change; amount and the transaction hash stay untouched
+        if converted != entries:
+            updates.append(pymongo.UpdateOne({"id": invoice["id"]}, {"$set": {"ledger_entries": converted}}))
+        if len(updates) >= 1000:
+            await db.invoices.bulk_write(updates, ordered=False)
+            updated_invoices += len(updates)
+            updates = []
+    if updates:
+        await db.invoices.bulk_write(updates, ordered=False)
+        updated_invoices += len(updates)
+    
+    if updated_invoices:
+        await refresh_ledger_snapshot(rebuild=True)
+    return updated_invoices
+
+async def backfill_missing_conversions():
+    try:
+        updated_invoices = await convert_stored_ledger_entries(only_missing=True)
+        if updated_invoices:
+            logger.info("Backfilled base-currency amounts for %d invoices", updated_invoices)
+    except Exception:
+        logger.exception("Base-currency backfill failed")
+
+# Columnar ledger snapshot
+ledger_snapshot = None
+snapshot_synced = False  # whether this process has caught the snapshot up with Mongo yet
+
+def get_ledger_snapshot():
+    """Open the columnar snapshot on first use, keeping numpy out of the startup path"""
+    
+    global ledger_snapshot
+    if ledger_snapshot is None:
+        from columnar_snapshot import LedgerSnapshot
+        ledger_snapshot = LedgerSnapshot(SNAPSHOT_DIR, rescan_seconds=SNAPSHOT_RESCAN_SECONDS)
+    return ledger_snapshot
+
+async def refresh_ledger_snapshot(rebuild: bool = False) -> int:
+    """Append invoices uploaded since the last refresh to the columnar snapshot"""
+
+    global snapshot_synced
+
+    def invoices_since(upload_date: str):
+        return db.invoices.find(
+            {"upload_date": {"$gte": upload_date}},
+            {"_id": 0, "file_content": 0}
+        ).sort("upload_date", 1)
+
+    appended = await get_ledger_snapshot().refresh(invoices_since, rebuild=rebuild)
+    snapshot_synced = True
+    return appended
+
+async def snapshot_refresh_loop():
+    # The first refresh waits a period; analytics requests refresh on demand before that
+    while True:
+        await asyncio.sleep(SNAPSHOT_REFRESH_SECONDS)
+        try:
+            await refresh_ledger_snapshot()
+        except Exception:
+            logger.exception("Ledger snapshot refresh failed")
+
 # API Endpoints
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "QuadLedger API"}
 
 @app.post("/api/upload-invoice")
-async def upload_invoice(file: UploadFile = File(...)):
+async def upload_invoice(file: UploadFile = File(...), on_duplicate: str = DUPLICATE_POLICY):
     """Upload and process invoice with automatic data extraction"""
     
     if not file.filename:
@@ -224,6 +632,9 @@ async def upload_invoice(file: UploadFile = File(...)):
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload PDF, JPEG, or PNG files.")
     
+    if on_duplicate not in ("flag", "reject"):
+        raise HTTPException(status_code=400, detail="Invalid on_duplicate. Use flag or reject")
+    
     try:
         # Read file content
         file_content = await file.read()
@@ -232,34 +643,71 @@ async def upload_invoice(file: UploadFile = File(...)):
         # Generate invoice ID
         invoice_id = str(uuid.uuid4())
         
-        # Extract invoice data using OpenAI
-        invoice_data = await extract_invoice_data(file_content, file.filename)
+        # Byte-identical re-uploads are the only duplicates certain enough to reject before extraction
+        content_hash = hashlib.sha256(file_content).hexdigest()
+        duplicate_of = await find_duplicates(content_hash=content_hash)
+        if duplicate_of and on_duplicate == "reject":
+            raise HTTPException(status_code=409, detail={"message": "Probable duplicate invoice", "duplicate_of": duplicate_of})
         
-        # Generate automatic ledger entries
-        ledger_entries = generate_ledger_entries(invoice_data, invoice_id)
+        # The same file may already be parked from an earlier upload during an outage
+        parked = await db.pending_invoices.find_one(
+            {"content_hash": content_hash, "status": "pending_extraction"}, {"_id": 0, "file_content": 0}
+        )
+        if parked:
+            if on_duplicate == "reject":
+                raise HTTPException(status_code=409, detail={"message": "Probable duplicate invoice", "duplicate_of": [parked["id"]]})
+            return JSONResponse(status_code=202, content={
+                "message": "Invoice already queued for extraction",
+                "pending_invoice": parked
+            })
         
-        # Create immutable transaction record
-        verified_transaction = create_verified_transaction(invoice_id, ledger_entries)
+        # PDF rendering and hashing are CPU-bound; keep them off the event loop
+        first_page = await asyncio.to_thread(render_first_page, file_content, file.filename)
+        page_hash = await asyncio.to_thread(compute_page_hash, first_page)
         
-        # Create complete invoice record
-        invoice_record = InvoiceRecord(
-            id=invoice_id,
-            filename=file.filename,
-            upload_date=datetime.now().isoformat(),
-            data=invoice_data,
-            ledger_entries=ledger_entries,
-            verified_transaction=verified_transaction,
-            file_content=file_base64
-        )
+        # Byte-identical uploads reuse the stored extraction instead of calling OpenAI again
+        identical = await db.invoices.find_one({"content_hash": content_hash}, {"_id": 0, "data": 1}) if duplicate_of else None
+        if identical:
+            invoice_data = InvoiceData(**identical["data"])
+        else:
+            # Extract invoice data using OpenAI
+            try:
+                invoice_data = await extract_invoice_data(file_content, file.filename, first_page)
+            except ExtractionError as e:
+                # Park the upload rather than posting guessed amounts to the ledger
+                pending = PendingInvoice(
+                    id=invoice_id,
+                    filename=file.filename,
+                    upload_date=datetime.now().isoformat(),
+                    file_content=file_base64,
+                    content_hash=content_hash,
+                    page_hash=page_hash,
+                    on_duplicate=on_duplicate,
+                    last_error=str(e)
+                )
+                await db.pending_invoices.insert_one(pending.model_dump())
+                return JSONResponse(status_code=202, content={
+                    "message": "Invoice queued for extraction",
+                    "pending_invoice": pending.model_dump(exclude={"file_content"})
+                })
         
-        # Store in database
-        await db.invoices.insert_one(invoice_record.model_dump())
+        duplicate_key = compute_duplicate_key(invoice_data.model_dump())
+        duplicate_of = sorted(await find_duplicates(content_hash, invoice_data.model_dump(), page_hash))
+        if duplicate_of and on_duplicate == "reject":
+            raise HTTPException(status_code=409, detail={"message": "Probable duplicate invoice", "duplicate_of": duplicate_of})
+        
+        invoice_record = await post_invoice(
+            invoice_id, file.filename, file_base64, invoice_data, content_hash, duplicate_key, page_hash, duplicate_of
+        )
         
         return {
             "message": "Invoice processed successfully",
-            "invoice": invoice_record.model_dump()
+            "invoice": invoice_record.model_dump(),
+            "probable_duplicate": bool(duplicate_of)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing invoice: {str(e)}")
 
@@ -300,6 +748,37 @@ async def get_ledger_entries():
     
     return {"ledger_entries": all_entries}
 
+@app.get("/api/ledger-balances")
+async def get_ledger_balances():
+    """Get debit/credit balances per account in the base currency"""
+    
+    # Aggregate in Mongo so every invoice counts; $sum skips null base_amount values
+    pipeline = [
+        {"$unwind": "$ledger_entries"},
+        {"$group": {
+            "_id": {"account": "$ledger_entries.account", "type": "$ledger_entries.type"},
+            "total": {"$sum": "$ledger_entries.base_amount"},
+            "unconverted": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$ledger_entries.base_amount", None]}, None]}, 1, 0]}}
+        }}
+    ]
+    balances = {}
+    
+    async for group in db.invoices.aggregate(pipeline):
+        account = group["_id"]["account"]
+        balance = balances.setdefault(account, {
+            "account": account, "debit": 0.0, "credit": 0.0, "unconverted_entries": 0
+        })
+        if group["_id"]["type"] in ("debit", "credit"):
+            balance[group["_id"]["type"]] += group["total"]
+        balance["unconverted_entries"] += group["unconverted"]
+    
+    for balance in balances.values():
+        balance["debit"] = round(balance["debit"], 2)
+        balance["credit"] = round(balance["credit"], 2)
+        balance["balance"] = round(balance["debit"] - balance["credit"], 2)
+    
+    return {"base_currency": fx_rates.base_currency, "balances": list(balances.values())}
+
 @app.get("/api/verified-transactions")
 async def get_verified_transactions():
     """Get all verified transactions (immutable records)"""
@@ -344,6 +823,7 @@ async def create_impact_entry(impact_data: dict):
         {"id": invoice_id},
         {"$set": {"impact_entry": impact_entry.model_dump()}}
     )
+    await get_ledger_snapshot().update_impact(invoice_id, impact_entry.model_dump())
     
     return {"message": "Impact entry created successfully", "impact_entry": impact_entry.model_dump()}
 
@@ -371,7 +851,20 @@ async def get_dashboard_summary():
     
     # Calculate summary statistics
     total_invoices = len(invoices)
-    total_amount = sum(inv.get("data", {}).get("amount", 0) for inv in invoices)
+    
+    # Amounts are reported in the base currency using the conversion stored on the debit entry
+    total_amount = 0.0
+    totals_by_currency = {}
+    unconverted_invoices = 0
+    for inv in invoices:
+        data = inv.get("data", {})
+        currency = data.get("currency", "USD")
+        totals_by_currency[currency] = totals_by_currency.get(currency, 0) + data.get("amount", 0)
+        debit = next((e for e in inv.get("ledger_entries", []) if e.get("type") == "debit"), {})
+        if debit.get("base_amount") is None:
+            unconverted_invoices += 1
+        else:
+            total_amount += debit["base_amount"]
     
     # Impact summary
     impact_invoices = [inv for inv in invoices if inv.get("impact_entry")]
@@ -390,7 +883,10 @@ async def get_dashboard_summary():
     return {
         "summary": {
             "total_invoices": total_invoices,
-            "total_amount": total_amount,
+            "total_amount": round(total_amount, 2),
+            "base_currency": fx_rates.base_currency,
+            "totals_by_currency": totals_by_currency,
+            "unconverted_invoices": unconverted_invoices,
             "verified_transactions": total_invoices,
             "impact_entries": len(impact_invoices),
             "total_co2_emissions": total_co2,
@@ -399,6 +895,185 @@ async def get_dashboard_summary():
         "recent_invoices": clean_recent_invoices
     }
 
+@app.get("/api/analytics/query")
+async def query_analytics(
+    group_by: List[str] = Query(default=[]),
+    bucket: Optional[str] = None,
+    metric: str = "base_amount",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    entry_type: Optional[str] = "debit"
+):
+    """Group-by / time-bucket aggregation over the columnar ledger snapshot"""
+
+    ledger_snapshot = get_ledger_snapshot()
+    invalid = [dimension for dimension in group_by if dimension not in ledger_snapshot.DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {', '.join(invalid)}")
+    if bucket and bucket not in ledger_snapshot.BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Use one of: {', '.join(ledger_snapshot.BUCKETS)}")
+    if metric not in ledger_snapshot.METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid metric. Use one of: {', '.join(ledger_snapshot.METRICS)}")
+    if entry_type not in ("debit", "credit", "all"):
+        raise HTTPException(status_code=400, detail="Invalid entry_type. Use debit, credit or all")
+    if metric == "amount" and "currency" not in group_by:
+        raise HTTPException(status_code=400, detail="amount mixes currencies; group by currency or use base_amount")
+    for name, value in (("start", start), ("end", end)):
+        if value and ledger_snapshot.parse_day(value) is None:
+            raise HTTPException(status_code=400, detail=f"Invalid {name} date. Use YYYY-MM-DD")
+
+    if not snapshot_synced:
+        await refresh_ledger_snapshot()
+    results = ledger_snapshot.query(group_by, bucket, metric, start, end, entry_type)
+    return {
+        "results": results,
+        "rows": ledger_snapshot.rows,
+        "refreshed_at": ledger_snapshot.refreshed_at
+    }
+
+@app.get("/api/analytics/snapshot")
+async def get_snapshot_status():
+    """Get columnar snapshot status"""
+
+    ledger_snapshot = get_ledger_snapshot()
+    return {
+        "rows": ledger_snapshot.rows,
+        "invoices": len(ledger_snapshot.invoice_rows),
+        "suppliers": len(ledger_snapshot.dictionaries["supplier"]),
+        "watermark": ledger_snapshot.watermark,
+        "refreshed_at": ledger_snapshot.refreshed_at
+    }
+
+@app.post("/api/analytics/snapshot/refresh")
+async def refresh_snapshot(rebuild: bool = False):
+    """Append new invoices to the columnar snapshot, or rebuild it from scratch"""
+
+    appended = await refresh_ledger_snapshot(rebuild=rebuild)
+    return {"message": "Snapshot refreshed successfully", "appended_invoices": appended, "rows": get_ledger_snapshot().rows}
+
+@app.get("/api/pending-invoices")
+async def get_pending_invoices():
+    """Get uploads parked while extraction was unavailable or failing"""
+    
+    pending = await db.pending_invoices.find({}, {"_id": 0, "file_content": 0}).to_list(1000)
+    return {
+        "pending_invoices": pending,
+        "extraction_circuit": extraction_client.breaker.state
+    }
+
+@app.post("/api/pending-invoices/reprocess")
+async def reprocess_pending(limit: int = PENDING_BATCH_SIZE):
+    """Retry extraction for a batch of parked uploads"""
+    
+    result = await reprocess_pending_invoices(limit)
+    return {"message": "Pending invoices reprocessed", **result, "extraction_circuit": extraction_client.breaker.state}
+
+@app.get("/api/duplicates")
+async def get_duplicate_clusters():
+    """List clusters of probable duplicate invoices across the whole collection"""
+
+    invoices = {}
+    uf = UnionFind()
+    first_seen = {}
+    band_members = {}
+    cursor = db.invoices.find({}, {
+        "_id": 0, "id": 1, "filename": 1, "upload_date": 1, "data": 1,
+        "content_hash": 1, "duplicate_key": 1, "page_hash": 1
+    })
+    # Single pass: exact keys are joined through a hash map. Page hashes are bucketed by band
+    # together with date and amount, so invoices sharing a template but not their figures never meet
+    async for invoice in cursor:
+        invoice_id = invoice["id"]
+        invoices[invoice_id] = invoice
+        uf.find(invoice_id)
+        duplicate_key = invoice.get("duplicate_key") or compute_duplicate_key(invoice.get("data", {}))
+        keys = [("key", duplicate_key)]
+        if invoice.get("content_hash"):
+            keys.append(("content", invoice["content_hash"]))
+        for key in keys:
+            if key in first_seen:
+                uf.union(invoice_id, first_seen[key])
+            else:
+                first_seen[key] = invoice_id
+        page_hash = invoice.get("page_hash")
+        if page_hash:
+            date_and_amount = tuple(duplicate_key.split("|")[1:3])
+            for band in page_hash_bands(page_hash):
+                members = band_members.setdefault((band, date_and_amount), [])
+                for other_id, other_hash in members:
+                    if page_hash_distance(page_hash, other_hash) <= PAGE_HASH_MAX_DISTANCE:
+                        uf.union(invoice_id, other_id)
+                if len(members) < PAGE_HASH_BUCKET_CAP:
+                    members.append((invoice_id, page_hash))
+
+    clusters = {}
+    for invoice_id in invoices:
+        clusters.setdefault(uf.find(invoice_id), []).append(invoice_id)
+
+    duplicate_clusters = []
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        duplicate_clusters.append({
+            "size": len(members),
+            "invoices": [
+                {
+                    "id": invoice_id,
+                    "filename": invoices[invoice_id].get("filename"),
+                    "upload_date": invoices[invoice_id].get("upload_date"),
+                    "data": invoices[invoice_id].get("data", {})
+                }
+                for invoice_id in sorted(members, key=lambda i: invoices[i].get("upload_date", ""))
+            ]
+        })
+    duplicate_clusters.sort(key=lambda cluster: cluster["size"], reverse=True)
+
+    return {"duplicate_clusters": duplicate_clusters}
+
+@app.post("/api/duplicates/backfill")
+async def backfill_duplicate_index():
+    """Compute duplicate-detection fields for invoices uploaded before they existed"""
+
+    updated_invoices = 0
+    cursor = db.invoices.find({"content_hash": {"$exists": False}}, {"_id": 0, "id": 1, "filename": 1, "data": 1, "file_content": 1})
+    async for invoice in cursor:
+        file_content = base64.b64decode(invoice.get("file_content", ""))
+        fields = {
+            "content_hash": hashlib.sha256(file_content).hexdigest(),
+            "duplicate_key": compute_duplicate_key(invoice.get("data", {}))
+        }
+        try:
+            first_page = await asyncio.to_thread(render_first_page, file_content, invoice.get("filename", ""))
+            fields["page_hash"] = await asyncio.to_thread(compute_page_hash, first_page)
+            fields["page_hash_bands"] = page_hash_bands(fields["page_hash"])
+        except Exception:
+            logger.warning("Could not render invoice %s for page hashing", invoice["id"])
+        await db.invoices.update_one({"id": invoice["id"]}, {"$set": fields})
+        updated_invoices += 1
+
+    return {"message": "Duplicate index backfilled successfully", "updated_invoices": updated_invoices}
+
+@app.get("/api/fx-rates")
+async def get_fx_rates():
+    """Get the loaded FX rate table"""
+
+    return {
+        "base_currency": fx_rates.base_currency,
+        "loaded_at": fx_rates.loaded_at,
+        "rates": {
+            currency: [{"date": date, "rate": rate} for date, rate in zip(fx_rates.dates[currency], fx_rates.rates[currency])]
+            for currency in fx_rates.dates
+        }
+    }
+
+@app.post("/api/fx-rates/reconvert")
+async def reconvert_ledger_entries():
+    """Reload the FX rate CSV and recompute base-currency amounts on every ledger entry"""
+
+    fx_rates.load()
+    updated_invoices = await convert_stored_ledger_entries()
+    return {"message": "Ledger entries reconverted successfully", "updated_invoices": updated_invoices}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -34,6 +34,10 @@ def test_upload_invoice():
             invoice_id = data["invoice"]["id"]
             print(f"Invoice ID: {invoice_id}")
             return invoice_id
+    elif response.status_code == 202:
+        # Extraction unavailable; the upload is parked and not yet in the ledger
+        data = response.json()
+        print(f"Response data: {data.get('message')} ({data['pending_invoice']['id']})")
     else:
         print(f"Error response: {response.text[:200]}")
     return None
@@ -80,7 +80,14 @@ function App() {
         },
       });
 
-      setUploadStatus('Invoice processed successfully!');
+      if (response.status === 202) {
+        // Extraction is unavailable; the invoice is parked and will be posted once it is re-processed
+        setUploadStatus('Invoice received and queued for extraction. It will appear in the ledger once processed.');
+      } else if (response.data.probable_duplicate) {
+        setUploadStatus('Invoice processed, but it looks like a duplicate of an existing invoice.');
+      } else {
+        setUploadStatus('Invoice processed successfully!');
+      }
       setTimeout(() => {
         setUploadStatus('');
         if (activeTab === 'dashboard') {
@@ -88,7 +95,11 @@ function App() {
         }
       }, 2000);
     } catch (error) {
-      setUploadStatus('Error processing invoice. Please try again.');
+      if (error.response && error.response.status === 409) {
+        setUploadStatus('This invoice appears to be a duplicate and was not uploaded.');
+      } else {
+        setUploadStatus('Error processing invoice. Please try again.');
+      }
       console.error('Upload error:', error);
     } finally {
       setLoading(false);
@@ -147,7 +158,11 @@ function App() {
         </div>
         {uploadStatus && (
           <div className={`mt-4 p-4 rounded-lg ${
-            uploadStatus.includes('Error') ? 'bg-red-100 text-red-700' : 'bg-green-100 text-green-700'
+            uploadStatus.includes('Error') || uploadStatus.includes('not uploaded')
+              ? 'bg-red-100 text-red-700'
+              : uploadStatus.includes('queued') || uploadStatus.includes('duplicate')
+                ? 'bg-yellow-100 text-yellow-700'
+                : 'bg-green-100 text-green-700'
           }`}>
             {uploadStatus}
           </div>
@@ -0,0 +1,101 @@
+"""Startup-time benchmark for the QuadLedger backend.
+
+Measures, each in a fresh interpreter, how long `import server` takes and how
+long uvicorn needs to answer the first /api/health request, and checks that
+the heavy extraction/analytics modules are still loaded lazily. Exits non-zero
+when a budget is exceeded so it can gate CI or a deploy script:
+
+    python scripts/startup_benchmark.py --runs 5 --max-import 1.0 --max-health 3.0
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+# Modules that must not be imported just by loading server.py
+LAZY_MODULES = ["openai", "pdf2image", "PIL", "numpy", "pandas", "boto3", "motor", "pymongo"]
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import server
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+def measure_import() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_first_health(timeout: float) -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/api/health"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode} before serving /api/health")
+            try:
+                with urllib.request.urlopen(url, timeout=0.5) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"/api/health did not respond within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import", type=float, default=1.0, help="budget for median `import server` seconds")
+    parser.add_argument("--max-health", type=float, default=3.0, help="budget for median seconds to first /api/health")
+    parser.add_argument("--health-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    healths = [measure_first_health(args.health_timeout) for _ in range(args.runs)]
+
+    import_median = statistics.median(run["seconds"] for run in imports)
+    health_median = statistics.median(healths)
+    eager = sorted({module for run in imports for module in run["loaded"]})
+
+    print(f"import server:       median {import_median:.3f}s  (min {min(r['seconds'] for r in imports):.3f}s, budget {args.max_import:.3f}s)")
+    print(f"first /api/health:   median {health_median:.3f}s  (min {min(healths):.3f}s, budget {args.max_health:.3f}s)")
+    print(f"eagerly imported:    {', '.join(eager) if eager else 'none'}")
+
+    failures = []
+    if import_median > args.max_import:
+        failures.append("import time over budget")
+    if health_median > args.max_health:
+        failures.append("time to first /api/health over budget")
+    if eager:
+        failures.append(f"heavy modules imported at load time: {', '.join(eager)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
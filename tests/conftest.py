@@ -0,0 +1,5 @@
+import os
+import sys
+
+# server.py and its modules are imported as top-level modules from backend/, as uvicorn does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
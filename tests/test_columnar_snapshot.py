@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import numpy as np
+
+from columnar_snapshot import LedgerSnapshot
+
+def make_invoice(invoice_id, supplier="ACME", amount=100.0, date="2025-01-15", currency="USD",
+                 upload_date="2025-01-20T10:00:00", impact=None, base_amount=None):
+    base_amount = amount if base_amount is None else base_amount
+    entries = [
+        {"type": "debit", "account": "Office Expenses", "amount": amount, "base_amount": base_amount},
+        {"type": "credit", "account": "Accounts Payable", "amount": amount, "base_amount": base_amount},
+    ]
+    return {
+        "id": invoice_id,
+        "upload_date": upload_date,
+        "data": {"supplier": supplier, "amount": amount, "date": date, "currency": currency},
+        "ledger_entries": entries,
+        "impact_entry": impact,
+    }
+
+def async_iter(items):
+    async def iterate():
+        for item in items:
+            yield item
+    return iterate()
+
+def test_append_writes_one_row_per_entry_and_skips_known_invoices(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+
+    assert snapshot.append([make_invoice("a"), make_invoice("b")]) == 2
+    assert snapshot.append([make_invoice("a"), make_invoice("c")]) == 1
+
+    assert snapshot.rows == 6
+    assert snapshot.invoice_rows == {"a": 0, "b": 2, "c": 4}
+
+def test_query_groups_by_dimension_and_bucket(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+    snapshot.append([
+        make_invoice("a", supplier="ACME", amount=10.0, date="2025-01-15"),
+        make_invoice("b", supplier="ACME", amount=20.0, date="2025-02-03"),
+        make_invoice("c", supplier="Globex", amount=5.0, date="2025-02-10"),
+    ])
+
+    results = snapshot.query(["supplier"], "month", "amount", None, None, "debit")
+
+    assert results == [
+        {"supplier": "ACME", "bucket": "2025-01", "sum": 10.0, "count": 1, "avg": 10.0},
+        {"supplier": "ACME", "bucket": "2025-02", "sum": 20.0, "count": 1, "avg": 20.0},
+        {"supplier": "Globex", "bucket": "2025-02", "sum": 5.0, "count": 1, "avg": 5.0},
+    ]
+
+def test_query_date_range_and_entry_type(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+    snapshot.append([
+        make_invoice("a", amount=10.0, date="2025-01-15"),
+        make_invoice("b", amount=20.0, date="2025-02-03"),
+    ])
+
+    assert snapshot.query([], None, "amount", "2025-02-01", None, "debit")[0]["sum"] == 20.0
+    assert snapshot.query([], None, "amount", None, "2025-01-31", "all")[0]["count"] == 2
+
+def test_query_base_amount_skips_unconverted_rows(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+    snapshot.append([make_invoice("a", amount=10.0, base_amount=12.0)])
+    invoice = make_invoice("b", amount=20.0, currency="JPY")
+    for entry in invoice["ledger_entries"]:
+        entry["base_amount"] = None
+    snapshot.append([invoice])
+
+    assert snapshot.query([], None, "base_amount", None, None, "debit") == [{"sum": 12.0, "count": 1, "avg": 12.0}]
+
+def test_update_impact_patches_debit_row(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+    snapshot.append([make_invoice("a"), make_invoice("b", impact={"co2_emissions": 1.5})])
+
+    assert asyncio.run(snapshot.update_impact("a", {"co2_emissions": 2.0}))
+    assert not asyncio.run(snapshot.update_impact("missing", {"co2_emissions": 9.0}))
+
+    assert snapshot.query([], None, "co2_emissions", None, None, "all") == [{"sum": 3.5, "count": 2, "avg": 1.75}]
+
+def test_reload_truncates_uncommitted_rows(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+    snapshot.append([make_invoice("a")])
+    # Simulate an append that crashed after writing column data but before meta.json
+    with open(os.path.join(str(tmp_path), "amount.bin"), "ab") as f:
+        np.asarray([999.0, 999.0], dtype="float64").tofile(f)
+
+    reloaded = LedgerSnapshot(str(tmp_path))
+
+    assert reloaded.rows == 2
+    assert os.path.getsize(os.path.join(str(tmp_path), "amount.bin")) == 2 * 8
+    assert reloaded.invoice_rows == {"a": 0}
+    reloaded.append([make_invoice("b", amount=5.0)])
+    assert reloaded.query([], None, "amount", None, None, "debit")[0]["sum"] == 105.0
+
+def test_refresh_rescans_window_behind_watermark(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path), rescan_seconds=600)
+    asyncio.run(snapshot.refresh(lambda since: async_iter([make_invoice("b", upload_date="2025-01-20T10:05:00")])))
+    seen = []
+
+    def invoices_since(since):
+        seen.append(since)
+        # "a" was stamped earlier but inserted after "b" had been picked up
+        return async_iter([make_invoice("a", upload_date="2025-01-20T10:04:00"),
+                           make_invoice("b", upload_date="2025-01-20T10:05:00")])
+
+    assert asyncio.run(snapshot.refresh(invoices_since)) == 1
+    assert seen == ["2025-01-20T09:55:00"]
+    assert set(snapshot.invoice_rows) == {"a", "b"}
+
+def test_rebuild_keeps_lock(tmp_path):
+    snapshot = LedgerSnapshot(str(tmp_path))
+    lock = snapshot._lock
+
+    asyncio.run(snapshot.refresh(lambda since: async_iter([make_invoice("a")]), rebuild=True))
+
+    assert snapshot._lock is lock
+    assert snapshot.rows == 2
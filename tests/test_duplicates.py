@@ -0,0 +1,141 @@
+import asyncio
+import random
+
+import pytest
+
+import server
+from server import (
+    PAGE_HASH_BANDS,
+    PAGE_HASH_MAX_DISTANCE,
+    PAGE_HASH_SIZE,
+    compute_duplicate_key,
+    get_duplicate_clusters,
+    normalize_supplier,
+    page_hash_bands,
+    page_hash_distance,
+)
+
+HASH_BITS = PAGE_HASH_SIZE * PAGE_HASH_SIZE
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield dict(document)
+
+class FakeInvoices:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self.documents)
+
+class FakeDb:
+    def __init__(self, invoices):
+        self.invoices = FakeInvoices(invoices)
+
+def to_hash(bits: int) -> str:
+    return f"{bits:0{HASH_BITS // 4}x}"
+
+def flip(page_hash: str, positions) -> str:
+    bits = int(page_hash, 16)
+    for position in positions:
+        bits ^= 1 << position
+    return to_hash(bits)
+
+def make_invoice(invoice_id, page_hash, date="2025-02-01", amount=120.0, supplier="ACME Inc."):
+    data = {"supplier": supplier, "date": date, "amount": amount, "currency": "USD"}
+    return {
+        "id": invoice_id,
+        "filename": f"{invoice_id}.pdf",
+        "upload_date": f"2025-02-0{len(invoice_id)}T10:00:00",
+        "data": data,
+        "content_hash": f"sha-{invoice_id}",
+        "duplicate_key": compute_duplicate_key(data),
+        "page_hash": page_hash,
+    }
+
+def cluster_ids(invoices, monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDb(invoices))
+    clusters = asyncio.run(get_duplicate_clusters())["duplicate_clusters"]
+    return sorted(sorted(invoice["id"] for invoice in cluster["invoices"]) for cluster in clusters)
+
+def test_normalize_supplier_drops_legal_suffixes_and_punctuation():
+    assert normalize_supplier("ACME, Inc.") == "acme"
+    assert normalize_supplier("Acme Widgets Co. Ltd") == "acme widgets"
+    assert normalize_supplier("Bürobedarf GmbH") == normalize_supplier("bürobedarf gmbh")
+
+def test_duplicate_key_formats_amount_and_currency():
+    key = compute_duplicate_key({"supplier": "ACME, Inc.", "date": "2025-01-02T00:00:00", "amount": 12.5, "currency": "eur"})
+
+    assert key == "acme|2025-01-02|12.50|EUR"
+    assert key == compute_duplicate_key({"supplier": "Acme LLC", "date": "2025-01-02", "amount": "12.50", "currency": "EUR"})
+
+def test_duplicate_key_differs_on_amount():
+    base = {"supplier": "ACME", "date": "2025-01-02", "currency": "USD"}
+
+    assert compute_duplicate_key({**base, "amount": 12.5}) != compute_duplicate_key({**base, "amount": 12.51})
+
+def test_bands_cover_the_whole_hash():
+    page_hash = to_hash(random.Random(1).getrandbits(HASH_BITS))
+    bands = page_hash_bands(page_hash)
+
+    assert len(bands) == PAGE_HASH_BANDS
+    assert "".join(band.split(":")[1] for band in bands) == page_hash
+
+@pytest.mark.parametrize("distance", range(0, PAGE_HASH_BANDS))
+def test_hashes_within_seven_bits_share_a_band(distance):
+    rng = random.Random(distance)
+    for _ in range(200):
+        page_hash = to_hash(rng.getrandbits(HASH_BITS))
+        other = flip(page_hash, rng.sample(range(HASH_BITS), distance))
+
+        assert page_hash_distance(page_hash, other) == distance
+        assert set(page_hash_bands(page_hash)) & set(page_hash_bands(other))
+
+def test_max_distance_is_within_band_guarantee():
+    assert PAGE_HASH_MAX_DISTANCE < PAGE_HASH_BANDS
+
+def test_rescan_with_same_figures_clusters(monkeypatch):
+    template = to_hash(random.Random(7).getrandbits(HASH_BITS))
+    invoices = [
+        make_invoice("a", template),
+        # Rescan: page hash a few bits off, supplier read slightly differently
+        make_invoice("bb", flip(template, [3, 90, 200]), supplier="Acme Incorporated"),
+    ]
+
+    assert cluster_ids(invoices, monkeypatch) == [["a", "bb"]]
+
+def test_same_template_with_different_figures_stays_apart(monkeypatch):
+    template = to_hash(random.Random(7).getrandbits(HASH_BITS))
+    invoices = [
+        make_invoice("a", template, supplier="ACME", amount=120.0),
+        make_invoice("bb", template, supplier="Globex", amount=80.0),
+        make_invoice("ccc", flip(template, [5]), supplier="Initech", date="2025-03-01"),
+        make_invoice("dddd", flip(template, [9]), supplier="Umbrella", amount=120.01),
+    ]
+
+    assert cluster_ids(invoices, monkeypatch) == []
+
+def test_far_page_hash_with_same_figures_needs_matching_key(monkeypatch):
+    rng = random.Random(3)
+    invoices = [
+        make_invoice("a", to_hash(rng.getrandbits(HASH_BITS)), supplier="ACME"),
+        make_invoice("bb", to_hash(rng.getrandbits(HASH_BITS)), supplier="Globex"),
+        make_invoice("ccc", to_hash(rng.getrandbits(HASH_BITS)), supplier="ACME Ltd"),
+    ]
+
+    assert cluster_ids(invoices, monkeypatch) == [["a", "ccc"]]
+
+def test_identical_bytes_cluster_even_with_different_extraction(monkeypatch):
+    rng = random.Random(5)
+    first = make_invoice("a", to_hash(rng.getrandbits(HASH_BITS)), amount=10.0)
+    second = make_invoice("bb", to_hash(rng.getrandbits(HASH_BITS)), amount=99.0)
+    second["content_hash"] = first["content_hash"]
+
+    assert cluster_ids([first, second], monkeypatch) == [["a", "bb"]]
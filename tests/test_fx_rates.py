@@ -0,0 +1,61 @@
+import pytest
+
+from server import FxRateTable
+
+@pytest.fixture
+def table(tmp_path):
+    path = tmp_path / "fx_rates.csv"
+    path.write_text(
+        "date,currency,rate\n"
+        "2025-04-01,EUR,1.08\n"
+        "2025-01-01,EUR,1.03\n"
+        "2025-01-01,gbp,1.25\n"
+        "2025-04-01,EUR,1.09\n"
+    )
+    return FxRateTable(str(path), "USD")
+
+def test_no_rate_before_first_date(table):
+    assert table.rate("EUR", "2024-12-31") is None
+
+def test_rate_effective_from_its_date(table):
+    assert table.rate("EUR", "2025-01-01") == 1.03
+    assert table.rate("EUR", "2025-03-31") == 1.03
+    assert table.rate("EUR", "2025-04-01") == 1.09
+
+def test_later_correction_wins_for_same_date(table):
+    assert table.rate("EUR", "2025-12-31") == 1.09
+
+def test_currency_codes_are_case_insensitive(table):
+    assert table.rate("eur", "2025-02-01") == 1.03
+    assert table.rate("GBP", "2025-02-01") == 1.25
+
+def test_base_currency_and_unknown_currency(table):
+    assert table.rate("USD", "1999-01-01") == 1.0
+    assert table.rate("JPY", "2025-02-01") is None
+
+def test_date_with_time_component(table):
+    assert table.rate("EUR", "2025-04-01T09:30:00") == 1.09
+
+def test_missing_file_only_knows_base_currency(tmp_path):
+    table = FxRateTable(str(tmp_path / "missing.csv"), "EUR")
+
+    assert table.rate("EUR", "2025-01-01") == 1.0
+    assert table.rate("USD", "2025-01-01") is None
+
+def test_invalid_rows_are_skipped(tmp_path, caplog):
+    path = tmp_path / "fx_rates.csv"
+    path.write_text(
+        "date,currency,rate\n"
+        "2025-01-01,EUR,1.03\n"
+        "2025-02-01,EUR,\n"
+        "not-a-date,EUR,1.50\n"
+        "2025-03-01,,1.20\n"
+        "2025-03-01,GBP,abc\n"
+        "2025-04-01,EUR,1.08\n"
+    )
+
+    table = FxRateTable(str(path), "USD")
+
+    assert table.dates == {"EUR": ["2025-01-01", "2025-04-01"]}
+    assert table.rate("EUR", "2025-03-15") == 1.03
+    assert "line 3" in caplog.text and "line 6" in caplog.text
@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import pytest
+
+from external_integrations.openai_extraction import (
+    CircuitBreaker,
+    ExtractionClient,
+    ExtractionError,
+    ExtractionUnavailable,
+)
+
+INVOICE = {"date": "2025-02-01", "supplier": "ACME", "amount": 12.5, "description": "office", "currency": "USD"}
+
+class FakeResponse:
+    def __init__(self, content):
+        message = type("Message", (), {"content": content})()
+        self.choices = [type("Choice", (), {"message": message})()]
+
+def make_client(outcomes, **kwargs):
+    """ExtractionClient whose _complete replays outcomes: exceptions are raised, strings returned as content"""
+
+    kwargs.setdefault("timeout", 0.05)
+    kwargs.setdefault("backoff_base", 0.0)
+    client = ExtractionClient(api_key="test", **kwargs)
+    calls = []
+
+    async def complete(image_base64):
+        calls.append(image_base64)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if outcome == "hang":
+            await asyncio.sleep(10)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return FakeResponse(outcome)
+
+    client._complete = complete
+    return client, calls
+
+def advance(breaker, seconds):
+    breaker.opened_at -= seconds
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == "closed"
+
+def test_breaker_half_open_allows_single_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    advance(breaker, 31)
+
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+def test_breaker_half_open_trial_outcomes():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    advance(breaker, 31)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    advance(breaker, 31)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_extract_parses_fenced_json():
+    client, calls = make_client(["```json\n" + json.dumps(INVOICE) + "\n```"])
+
+    assert asyncio.run(client.extract("img")) == INVOICE
+    assert len(calls) == 1
+
+def test_extract_retries_timeouts_then_succeeds():
+    client, calls = make_client(["hang", json.dumps(INVOICE)], max_retries=2)
+
+    assert asyncio.run(client.extract("img")) == INVOICE
+    assert len(calls) == 2
+    assert client.breaker.state == "closed" and client.breaker.failures == 0
+
+def test_extract_gives_up_after_max_retries():
+    client, calls = make_client(["hang"], max_retries=2)
+
+    with pytest.raises(ExtractionUnavailable):
+        asyncio.run(client.extract("img"))
+    assert len(calls) == 3
+    assert client.breaker.failures == 3
+
+def test_open_breaker_fails_fast_without_calling():
+    client, calls = make_client([json.dumps(INVOICE)], breaker=CircuitBreaker(failure_threshold=1))
+    client.breaker.record_failure()
+
+    with pytest.raises(ExtractionUnavailable):
+        asyncio.run(client.extract("img"))
+    assert calls == []
+
+def test_non_json_reply_is_extraction_error_not_outage():
+    client, _ = make_client(["I could not read this invoice"])
+
+    with pytest.raises(ExtractionError) as excinfo:
+        asyncio.run(client.extract("img"))
+    assert not isinstance(excinfo.value, ExtractionUnavailable)
+    assert client.breaker.state == "closed"
+
+def test_cancelled_half_open_trial_releases_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    client, _ = make_client(["hang"], timeout=5, breaker=breaker)
+    breaker.record_failure()
+    advance(breaker, 31)
+
+    async def cancel_trial():
+        task = asyncio.create_task(client.extract("img"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+
+    assert breaker.state == "open"
+    advance(breaker, 31)
+    assert breaker.allow()
+
+def test_unexpected_error_releases_half_open_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    client, _ = make_client([ValueError("boom")], breaker=breaker)
+    breaker.record_failure()
+    advance(breaker, 31)
+
+    with pytest.raises(ValueError):
+        asyncio.run(client.extract("img"))
+
+    advance(breaker, 31)
+    assert breaker.allow()
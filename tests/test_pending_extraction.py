@@ -0,0 +1,240 @@
+import asyncio
+import io
+import json
+
+import pytest
+from PIL import Image
+from starlette.datastructures import Headers, UploadFile
+
+import server
+from external_integrations.openai_extraction import CircuitBreaker, ExtractionError, ExtractionUnavailable
+
+INVOICE = {"date": "2025-02-01", "supplier": "ACME", "amount": 12.5, "description": "office", "currency": "USD"}
+
+def field(document, path):
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = field(document, key)
+        if isinstance(condition, dict) and "$in" in condition:
+            values = value if isinstance(value, list) else [value]
+            if not set(values) & set(condition["$in"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        self.documents = sorted(self.documents, key=lambda document: document.get(key), reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.documents[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+class FakeCollection:
+    """The subset of the Motor collection API the extraction paths use, filtering on equality, $or and $in"""
+
+    def __init__(self):
+        self.documents = []
+
+    @staticmethod
+    def project(document, projection):
+        excluded = {key for key, value in (projection or {}).items() if not value}
+        return {key: value for key, value in document.items() if key not in excluded}
+
+    async def insert_one(self, document):
+        self.documents.append(dict(document))
+
+    async def find_one(self, query, projection=None):
+        for document in self.documents:
+            if matches(document, query):
+                return self.project(document, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([self.project(document, projection) for document in self.documents if matches(document, query or {})])
+
+    async def update_one(self, query, update):
+        for document in self.documents:
+            if matches(document, query):
+                document.update(update["$set"])
+                return
+
+    async def delete_one(self, query):
+        self.documents = [document for document in self.documents if not matches(document, query)]
+
+    async def count_documents(self, query):
+        return sum(matches(document, query) for document in self.documents)
+
+class FakeDb:
+    def __init__(self):
+        self.invoices = FakeCollection()
+        self.pending_invoices = FakeCollection()
+
+class FakeExtractionClient:
+    """Replays outcomes per call: exceptions are raised, dicts returned as extracted data"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.breaker = CircuitBreaker()
+
+    async def extract(self, image_base64):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return dict(outcome)
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb()
+    monkeypatch.setattr(server, "db", fake)
+    return fake
+
+def use_extraction(monkeypatch, *outcomes):
+    client = FakeExtractionClient(*outcomes)
+    monkeypatch.setattr(server, "extraction_client", client)
+    return client
+
+def png_bytes(shade=255):
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 48), color=(shade, shade, shade)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def upload(content, on_duplicate="flag"):
+    file = UploadFile(io.BytesIO(content), filename="invoice.png", headers=Headers({"content-type": "image/png"}))
+    return asyncio.run(server.upload_invoice(file, on_duplicate=on_duplicate))
+
+def body(response):
+    return json.loads(response.body)
+
+def park(db, content, **fields):
+    pending = server.PendingInvoice(
+        id=fields.pop("id", "pending-1"),
+        filename="invoice.png",
+        upload_date=fields.pop("upload_date", "2025-02-01T10:00:00"),
+        file_content=server.base64.b64encode(content).decode(),
+        content_hash=server.hashlib.sha256(content).hexdigest(),
+        **fields
+    )
+    asyncio.run(db.pending_invoices.insert_one(pending.model_dump()))
+    return pending
+
+def test_upload_is_parked_when_extraction_is_unavailable(db, monkeypatch):
+    use_extraction(monkeypatch, ExtractionUnavailable("circuit open"))
+
+    response = upload(png_bytes())
+
+    assert response.status_code == 202
+    assert body(response)["message"] == "Invoice queued for extraction"
+    assert "file_content" not in body(response)["pending_invoice"]
+    assert db.invoices.documents == []
+    [pending] = db.pending_invoices.documents
+    assert pending["status"] == "pending_extraction"
+    assert pending["last_error"] == "circuit open"
+
+def test_reupload_returns_the_parked_record(db, monkeypatch):
+    client = use_extraction(monkeypatch, ExtractionUnavailable("circuit open"))
+    first = body(upload(png_bytes()))["pending_invoice"]
+
+    response = upload(png_bytes())
+
+    assert response.status_code == 202
+    assert body(response)["message"] == "Invoice already queued for extraction"
+    assert body(response)["pending_invoice"]["id"] == first["id"]
+    assert len(db.pending_invoices.documents) == 1
+    assert client.calls == 1
+
+def test_reupload_of_parked_file_is_rejected_under_reject_policy(db, monkeypatch):
+    use_extraction(monkeypatch, ExtractionUnavailable("circuit open"))
+    first = body(upload(png_bytes()))["pending_invoice"]
+
+    with pytest.raises(server.HTTPException) as error:
+        upload(png_bytes(), on_duplicate="reject")
+
+    assert error.value.status_code == 409
+    assert error.value.detail["duplicate_of"] == [first["id"]]
+
+def test_reprocess_posts_and_removes_parked_upload(db, monkeypatch):
+    use_extraction(monkeypatch, INVOICE)
+    park(db, png_bytes())
+
+    result = asyncio.run(server.reprocess_pending_invoices())
+
+    assert result == {"processed": 1, "failed": 0, "rejected": 0, "remaining": 0}
+    [invoice] = db.invoices.documents
+    assert invoice["id"] == "pending-1"
+    assert db.pending_invoices.documents == []
+
+def test_reprocess_rejects_duplicate_under_reject_policy(db, monkeypatch):
+    use_extraction(monkeypatch, INVOICE)
+    asyncio.run(db.invoices.insert_one({"id": "posted-1", "duplicate_key": server.compute_duplicate_key(INVOICE)}))
+    park(db, png_bytes(), on_duplicate="reject")
+
+    result = asyncio.run(server.reprocess_pending_invoices())
+
+    assert result["rejected"] == 1
+    [pending] = db.pending_invoices.documents
+    assert pending["status"] == "duplicate_rejected"
+    assert pending["duplicate_of"] == ["posted-1"]
+    assert len(db.invoices.documents) == 1
+
+def test_reprocess_gives_up_after_max_attempts(db, monkeypatch):
+    use_extraction(monkeypatch, ExtractionError("incomplete data"))
+    park(db, png_bytes())
+
+    for attempt in range(1, server.PENDING_MAX_ATTEMPTS + 1):
+        result = asyncio.run(server.reprocess_pending_invoices())
+        [pending] = db.pending_invoices.documents
+        assert pending["attempts"] == attempt
+        assert result["failed"] == 1
+
+    assert pending["status"] == "extraction_failed"
+    assert pending["last_error"] == "incomplete data"
+    assert result["remaining"] == 0
+
+def test_reprocess_stops_batch_while_extraction_is_unavailable(db, monkeypatch):
+    client = use_extraction(monkeypatch, ExtractionUnavailable("circuit open"))
+    park(db, png_bytes(0), id="older", upload_date="2025-02-01T10:00:00")
+    park(db, png_bytes(255), id="newer", upload_date="2025-02-02T10:00:00")
+
+    result = asyncio.run(server.reprocess_pending_invoices())
+
+    assert result["remaining"] == 2
+    assert client.calls == 1
+    assert all(pending.get("attempts") == 0 for pending in db.pending_invoices.documents)
+
+def test_unexpected_error_does_not_block_the_batch(db, monkeypatch):
+    use_extraction(monkeypatch, INVOICE)
+    corrupt = park(db, b"not an image", id="corrupt", upload_date="2025-02-01T10:00:00")
+    park(db, png_bytes(), id="valid", upload_date="2025-02-02T10:00:00")
+
+    result = asyncio.run(server.reprocess_pending_invoices())
+
+    assert result == {"processed": 1, "failed": 1, "rejected": 0, "remaining": 1}
+    assert [invoice["id"] for invoice in db.invoices.documents] == ["valid"]
+    [pending] = db.pending_invoices.documents
+    assert pending["id"] == corrupt.id
+    assert pending["attempts"] == 1
+    assert "UnidentifiedImageError" in pending["last_error"]
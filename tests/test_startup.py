@@ -0,0 +1,16 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+
+from startup_benchmark import BACKEND_DIR, LAZY_MODULES
+
+def test_import_server_loads_no_heavy_modules():
+    # A fresh interpreter, since this test session has already imported most of them
+    probe = f"import json, sys, server; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    output = subprocess.run([sys.executable, "-c", probe], cwd=BACKEND_DIR, check=True, capture_output=True, text=True).stdout
+
+    assert json.loads(output.strip().splitlines()[-1]) == []